@@ -1,10 +1,9 @@
-import re
-from bs4 import BeautifulSoup, NavigableString
+import html
+import sys
+from collections import defaultdict
+from selectolax.lexbor import LexborHTMLParser
 import streamlit as st
-import json
-import lxml.html
-import lxml.etree
-import pandas as pd
+import orjson
 
 # --- 1. CONFIGURACIÓN ---
 MIN_HIJOS_REQUERIDOS = 4  # Requiere 4 o más instancias (unidades semánticas)
@@ -13,108 +12,167 @@ UMBRAL_FRECUENCIA = 0.6
 
 # --- 2. FUNCIONES AUXILIARES PARA EL RASTREO (CSS Path y XPath) ---
 
-def get_css_path(tag):
+def posiciones_de_hijos(parent, pos_cache):
+    """
+    Devuelve {mem_id del hijo: nth-of-type} para los hijos-etiqueta de `parent`.
+    Se calcula recorriendo los hijos una sola vez y se guarda en `pos_cache`
+    (mem_id del padre -> posiciones), compartido por get_xpath y get_css_path.
+    La caché es por árbol: los mem_id no son válidos entre documentos.
+    """
+    posiciones = pos_cache.get(parent.mem_id)
+    if posiciones is None:
+        posiciones = {}
+        contadores = defaultdict(int)
+        for child in parent.iter():
+            if child.is_element_node:
+                contadores[child.tag] += 1
+                posiciones[child.mem_id] = contadores[child.tag]
+        pos_cache[parent.mem_id] = posiciones
+    return posiciones
+
+
+def get_css_path(tag, pos_cache=None):
+    if pos_cache is None: pos_cache = {}
     path = []
-    for parent in tag.parents:
-        if parent is None or parent.name == '[document]': break
-        sibling_index = 0
-        tag_name = parent.name
-        siblings = list(parent.parent.children) if parent.parent else []
-        for sibling in siblings:
-            if sibling.name == tag_name: sibling_index += 1
-            if sibling is parent:
-                path.append(f"{tag_name}:nth-of-type({sibling_index})");
-                break
+    parent = tag.parent
+    while parent is not None and not parent.is_document_node:
+        sibling_index = posiciones_de_hijos(parent.parent, pos_cache)[parent.mem_id]
+        path.append(f"{parent.tag}:nth-of-type({sibling_index})")
+        parent = parent.parent
     return " > ".join(reversed(path))
 
 
-def get_xpath(tag):
+def get_xpath(tag, pos_cache=None):
+    if pos_cache is None: pos_cache = {}
     path = []
-    for parent in tag.parents:
-        if parent is None or parent.name == '[document]': break
-        tag_name = parent.name
-        count = 1
-
-        # <<< MEJORA: Solo contar hermanos que son etiquetas y tienen el mismo nombre >>>
-        for sibling in parent.previous_siblings:
-            if hasattr(sibling, 'name') and sibling.name == tag_name:
-                count += 1
-        # *****************************************************************************
-
-        path.append(f"{tag_name}[{count}]")
+    parent = tag.parent
+    while parent is not None and not parent.is_document_node:
+        # Solo cuentan los hermanos que son etiquetas y tienen el mismo nombre
+        count = posiciones_de_hijos(parent.parent, pos_cache)[parent.mem_id]
+        path.append(f"{parent.tag}[{count}]")
+        parent = parent.parent
     return "/" + "/".join(reversed(path))
 
 
+def escapar_atributo(valor):
+    """Escapa un valor de atributo como el serializador de bs4: solo &, <, > y comillas dobles."""
+    return html.escape("" if valor is None else valor, quote=False).replace('"', "&quot;")
+
+
 # --- 3. FUNCIONES DE LÓGICA DE PATRONES ---
 
-def generar_huella(tag):
-    if not tag or not hasattr(tag, 'name') or tag.name is None: return ""
-    parts = []
-    for child in tag.find_all(True, recursive=False):
-        child_huella = generar_huella(child)
-        parts.append(child.name + (f"[{child_huella}]" if child_huella else ""))
-    return "+".join(parts)
+def hijos_elemento(tag):
+    """Hijos directos que son etiquetas (Lexbor también devuelve comentarios en iter())."""
+    return [c for c in tag.iter() if c.is_element_node]
+
+
+def generar_huella(tag, memo=None):
+    """
+    Huella estructural del tag. `memo` (mem_id -> huella) permite que los
+    subárboles ya visitados no se vuelvan a recorrer.
+
+    Recorrido post-orden iterativo con pila explícita: cada nodo se visita una
+    sola vez y no hay límite de recursión en HTML muy profundo.
+    """
+    if tag is None or not tag.is_element_node: return ""
+    if memo is None: memo = {}
+
+    # (nodo, hijos) — hijos es None mientras el nodo no se ha expandido
+    pila = [(tag, None)]
+    while pila:
+        nodo, hijos = pila.pop()
+        if nodo.mem_id in memo: continue
+        if hijos is None:
+            hijos = hijos_elemento(nodo)
+            pila.append((nodo, hijos))
+            pila.extend((h, None) for h in hijos if h.mem_id not in memo)
+            continue
+        parts = []
+        for child in hijos:
+            child_huella = memo[child.mem_id]
+            parts.append(child.tag + (f"[{child_huella}]" if child_huella else ""))
+        memo[nodo.mem_id] = "+".join(parts)
+    return memo[tag.mem_id]
 
 
 def obtener_atributos_descendientes_con_ruta_y_texto(tag):
     """
-    Recorre el tag y sus descendientes, devolviendo una lista de tuplas:
-    (ruta_relativa_key, nombre_atributo_o_text, valor)
+    Recorre el tag y sus descendientes en una sola pasada, devolviendo dos
+    listas paralelas (sin una tupla por atributo):
+    claves ("ruta_relativa_key@nombre_atributo_o_text", internadas) y valores
     """
-    atributos_encontrados = []
+    claves = []
+    valores = []
+    agregar_clave = claves.append
+    agregar_valor = valores.append
 
-    for i, descendant in enumerate(tag.descendants):
+    descendientes = tag.traverse(include_text=True)
+    next(descendientes, None)  # traverse() incluye el propio tag
 
-        is_tag = hasattr(descendant, 'name') and descendant.name is not None
+    for i, descendant in enumerate(descendientes):
 
         # A. PROCESAR ATRIBUTOS (Solo si es una etiqueta)
-        if is_tag:
-            relative_key = f"{descendant.name}[{i}]"
-            for attr_name, attr_value in descendant.attrs.items():
-                value = " ".join(attr_value) if isinstance(attr_value, list) else str(attr_value)
-                atributos_encontrados.append((relative_key, attr_name, value))
-
-        # B. PROCESAR TEXTO (Solo si es una cadena de texto navegable)
-        elif isinstance(descendant, NavigableString):
-            clean_text = str(descendant).strip()
+        if descendant.is_element_node:
+            relative_key = f"{descendant.tag}[{i}]"
+            for attr_name, attr_value in descendant.attributes.items():
+                value = "" if attr_value is None else attr_value
+                agregar_clave(sys.intern(f"{relative_key}@{attr_name}"))
+                agregar_valor(value)
+
+        # B. PROCESAR TEXTO (Nodos de texto y comentarios, como las NavigableString de bs4)
+        elif descendant.is_text_node or descendant.is_comment_node:
+            raw_text = descendant.text(deep=False) if descendant.is_text_node else descendant.comment_content
+            clean_text = (raw_text or "").strip()
             if clean_text:
-                parent_name = descendant.parent.name if descendant.parent and hasattr(descendant.parent,
-                                                                                      'name') else 'unknown'
+                parent_name = descendant.parent.tag if descendant.parent is not None else 'unknown'
                 text_key = f"{parent_name}_text[{i}]"
-                atributos_encontrados.append((text_key, "text_content", clean_text))
+                agregar_clave(sys.intern(f"{text_key}@text_content"))
+                agregar_valor(clean_text)
 
-    return atributos_encontrados
+    return claves, valores
 
 
 # --- 4. ALGORITMO PRINCIPAL (Devuelve metadata y datos de instancias) ---
 
 def encontrar_contenedores_relevantes(html_content):
-    soup = BeautifulSoup(html_content, 'lxml')
+    tree = LexborHTMLParser(html_content)
     contenedores_encontrados = []
     instancias_encontradas = []
 
-    # Set para rastrear los XPaths ya procesados (solución a la duplicidad)
+    # Set para rastrear los XPaths ya procesados (solución a la duplicidad).
+    # get_xpath() solo depende de los ancestros del contenedor, así que el
+    # mem_id de su padre identifica el XPath sin tener que construirlo.
     xpaths_unicos = set()
-
-    for elemento_padre in soup.find_all(True):
-        hijos = [h for h in elemento_padre.contents if hasattr(h, 'name') and h.name is not None]
+    # Huellas de todo el documento (mem_id -> huella) en una sola pasada
+    # post-orden, antes del bucle: cada nodo se calcula exactamente una vez
+    huellas = {}
+    generar_huella(tree.root, huellas)
+    # Posiciones nth-of-type por padre, compartidas por get_xpath/get_css_path
+    posiciones = {}
+
+    # traverse() es un generador: no se materializa una lista con todos los
+    # nodos del documento antes de empezar (a diferencia de find_all(True))
+    for elemento_padre in tree.root.traverse(include_text=False):
+        if not elemento_padre.is_element_node: continue
+        hijos = hijos_elemento(elemento_padre)
 
         # Filtro de rendimiento: descartar si no tiene suficientes hijos directos (al menos 4)
         if len(hijos) < MIN_HIJOS_REQUERIDOS: continue
 
-        agrupados_por_huella = {}
+        # Agrupar por huella llevando a la vez el grupo dominante (sin max() posterior).
+        # Un empate en el máximo nunca supera UMBRAL_FRECUENCIA, así que el
+        # desempate entre grupos no cambia el resultado.
+        agrupados_por_huella = defaultdict(list)
+        huella_dominante, unidades_semanticas, frecuencia_maxima = None, None, 0
         for hijo in hijos:
-            huella = generar_huella(hijo)
+            huella = huellas[hijo.mem_id]
             if huella:
-                if huella not in agrupados_por_huella: agrupados_por_huella[huella] = []
-                agrupados_por_huella[huella].append(hijo)
+                grupo = agrupados_por_huella[huella]
+                grupo.append(hijo)
+                if len(grupo) > frecuencia_maxima:
+                    huella_dominante, unidades_semanticas, frecuencia_maxima = huella, grupo, len(grupo)
         if not agrupados_por_huella: continue
 
-        huella_dominante, unidades_semanticas = max(
-            agrupados_por_huella.items(), key=lambda item: len(item[1])
-        )
-        frecuencia_maxima = len(unidades_semanticas)
-
         # FILTRO DE INSTANCIAS (UNIDADES SEMÁNTICAS):
         # Aseguramos que la cantidad de instancias repetidas (frecuencia_maxima)
         # sea mayor o igual que el mínimo requerido (4).
@@ -123,36 +181,36 @@ def encontrar_contenedores_relevantes(html_content):
 
         if (frecuencia_maxima / len(hijos)) >= UMBRAL_FRECUENCIA:
 
-            # 1. Identificar variables
-            lista_de_atributos_por_unidad = [
-                obtener_atributos_descendientes_con_ruta_y_texto(unidad)
+            # 1. Identificar variables (un único recorrido de descendientes por unidad)
+            unidad_maps = [
+                dict(zip(*obtener_atributos_descendientes_con_ruta_y_texto(unidad)))
                 for unidad in unidades_semanticas
             ]
-            mapa_valores_por_clave = {}
-            for atributos_unidad in lista_de_atributos_por_unidad:
-                for relative_key, attr_name, attr_value in atributos_unidad:
-                    clave_atributo = (relative_key, attr_name)
-                    if clave_atributo not in mapa_valores_por_clave: mapa_valores_por_clave[clave_atributo] = []
-                    mapa_valores_por_clave[clave_atributo].append(attr_value)
+            mapa_valores_por_clave = defaultdict(list)
+            for unidad_map in unidad_maps:
+                for attr_key, attr_value in unidad_map.items():
+                    mapa_valores_por_clave[attr_key].append(attr_value)
 
             variable_attrs_final = []
-            for (relative_key, attr_name), valores in mapa_valores_por_clave.items():
+            for attr_key, valores in mapa_valores_por_clave.items():
                 if len(valores) == frecuencia_maxima:
                     if len(set(valores)) > 1:
-                        variable_attrs_final.append(f"{relative_key}@{attr_name}")
+                        variable_attrs_final.append(attr_key)
 
             # FILTRO: Descartar contenedores sin variables semánticas
             if not variable_attrs_final:
                 continue
 
+            # *** FILTRO DE UNICIDAD ***
+            clave_xpath = elemento_padre.parent.mem_id
+            if clave_xpath in xpaths_unicos:
+                continue  # Saltar si este XPath ya ha sido procesado
+            xpaths_unicos.add(clave_xpath)
+            # **************************
+
             # --- EXTRAER DATOS DE INSTANCIA ---
             data_instances = []
-            for unidad in unidades_semanticas:
-
-                unidad_lookup_map = {}
-                for relative_key, attr_name, attr_value in obtener_atributos_descendientes_con_ruta_y_texto(unidad):
-                    unidad_lookup_map[f"{relative_key}@{attr_name}"] = attr_value
-
+            for unidad_lookup_map in unidad_maps:
                 instance_data = {}
                 for attr_key in variable_attrs_final:
                     instance_data[attr_key] = unidad_lookup_map.get(attr_key, "N/A (No Encontrado)")
@@ -162,26 +220,22 @@ def encontrar_contenedores_relevantes(html_content):
             # 3. Construir metadata y objeto de instancia
             if unidades_semanticas:
                 unidad_ejemplo = unidades_semanticas[0]
-                container_xpath = get_xpath(elemento_padre)
+                container_xpath = get_xpath(elemento_padre, posiciones)
 
-                # *** FILTRO DE UNICIDAD ***
-                if container_xpath in xpaths_unicos:
-                    continue  # Saltar si este XPath ya ha sido procesado
-                xpaths_unicos.add(container_xpath)
-                # **************************
-
-                preview = elemento_padre.prettify().splitlines()[0]
+                # Solo la etiqueta de apertura: no hace falta serializar el subárbol
+                atributos_preview = list(elemento_padre.attributes.items())[:4]
+                preview = f"<{elemento_padre.tag}" + "".join(
+                    f' {k}="{escapar_atributo(v)}"' for k, v in atributos_preview
+                ) + ">"
                 if len(preview) > 80:
                     preview = preview[:77] + "..."
-                elif not preview.endswith('>'):
-                    preview = preview + "..."
 
                 # Metadata del Contenedor
                 resultado = {
-                    "container_tag": elemento_padre.name,
-                    "unit_root_tag": unidad_ejemplo.name,
+                    "container_tag": elemento_padre.tag,
+                    "unit_root_tag": unidad_ejemplo.tag,
                     "unit_count": frecuencia_maxima,
-                    "container_css_path": get_css_path(elemento_padre),
+                    "container_css_path": get_css_path(elemento_padre, posiciones),
                     "container_xpath": container_xpath,
                     "container_preview": preview,
                     "semantic_variable_attrs": variable_attrs_final,
@@ -192,20 +246,14 @@ def encontrar_contenedores_relevantes(html_content):
                 # Datos de las Instancias
                 instancia_contenedor = {
                     "container_xpath": container_xpath,
-                    "unit_root_tag": unidad_ejemplo.name,
+                    "unit_root_tag": unidad_ejemplo.tag,
                     "instances": data_instances
                 }
                 instancias_encontradas.append(instancia_contenedor)
 
-    # Filtrar también las instancias para garantizar que solo devolvemos las asociadas a XPaths únicos.
-    instancias_filtradas = []
-    xpaths_instancias_unicos = set()
-    for inst in instancias_encontradas:
-        if inst['container_xpath'] not in xpaths_instancias_unicos:
-            instancias_filtradas.append(inst)
-            xpaths_instancias_unicos.add(inst['container_xpath'])
-
-    return contenedores_encontrados, instancias_filtradas
+    # Las instancias se añaden junto con su contenedor tras el filtro de
+    # unicidad, así que ya están asociadas a XPaths únicos.
+    return contenedores_encontrados, instancias_encontradas
 
 
 # -------------------------------------------------------------
@@ -256,6 +304,24 @@ def clear_session_state():
     st.session_state.all_instances_data = []
 
 
+@st.cache_data(max_entries=8)
+def analizar_html(html_content):
+    """Resultado de encontrar_contenedores_relevantes cacheado por HTML (los reruns no re-parsean)."""
+    return encontrar_contenedores_relevantes(html_content)
+
+
+@st.cache_data(max_entries=8)
+def serializar_json(_datos, html_content, tipo, indentar=False):
+    """
+    Serializa resultados a JSON con orjson, compacto por defecto (`indentar`
+    activa la sangría de 2 espacios). La caché se indexa por el HTML de
+    entrada, el tipo de salida y `indentar` (`_datos` no se hashea), así que
+    los reruns no vuelven a serializar.
+    """
+    option = orjson.OPT_INDENT_2 if indentar else None
+    return orjson.dumps(_datos, option=option).decode("utf-8")
+
+
 # --- BARRA LATERAL (SIDEBAR) ---
 
 st.sidebar.title("🛠️ Entrada de Datos HTML")
@@ -300,7 +366,7 @@ if st.session_state.html_content:
     html_content = st.session_state.html_content
 
     try:
-        contenedores_encontrados, instancias_encontradas = encontrar_contenedores_relevantes(html_content)
+        contenedores_encontrados, instancias_encontradas = analizar_html(html_content)
         st.session_state.all_instances_data = instancias_encontradas
 
     except Exception as e:
@@ -406,14 +472,16 @@ if st.session_state.html_content:
     st.markdown("---")
     st.header("📄 Resultados Crudos para Copiar (JSON)")
 
+    indentar_json = st.checkbox("Indentar JSON", value=False, key="indentar_json")
+
     col_json_containers, col_json_instances = st.columns(2)
 
     # Salida de Contenedores
     with col_json_containers:
         st.subheader("Contenedores Detectados")
 
-        # Convertir la lista de diccionarios a una cadena JSON formateada
-        json_contenedores = json.dumps(contenedores_encontrados, indent=2, ensure_ascii=False)
+        # Convertir la lista de diccionarios a una cadena JSON (compacta o indentada)
+        json_contenedores = serializar_json(contenedores_encontrados, html_content, "contenedores", indentar_json)
 
         # Usar st.code para mostrar y permitir la copia
         st.code(json_contenedores, language='json', line_numbers=True)
@@ -422,8 +490,8 @@ if st.session_state.html_content:
     with col_json_instances:
         st.subheader("Datos de Todas las Instancias")
 
-        # Convertir la lista de diccionarios a una cadena JSON formateada
-        json_instancias = json.dumps(instancias_encontradas, indent=2, ensure_ascii=False)
+        # Convertir la lista de diccionarios a una cadena JSON (compacta o indentada)
+        json_instancias = serializar_json(instancias_encontradas, html_content, "instancias", indentar_json)
 
         # Usar st.code para mostrar y permitir la copia
         st.code(json_instancias, language='json', line_numbers=True)
@@ -6,11 +6,36 @@ Detector de contenedores semánticos y atributos (versión 100% estadística).
 No usa listas hardcodeadas de atributos ni regex "temáticos".
 """
 
-from bs4 import BeautifulSoup
+from selectolax.lexbor import LexborHTMLParser
 from collections import defaultdict
-import statistics
+import multiprocessing as mp
+import numpy as np
 from typing import List, Dict, Any
 
+# Etiquetas cuyo texto no forma parte del texto visible de sus ancestros (como
+# en get_text() de bs4); conservan su propia entrada `script::text`/`style::text`
+NON_VISIBLE_TEXT_TAGS = frozenset({"script", "style"})
+
+# El pool solo compensa con mucho trabajo: arrancar los procesos spawn cuesta
+# ~0.4 s fijos y cada worker re-parsea su fragmento (~0.1 s/MB extra), frente a
+# ~0.14 s/MB del análisis secuencial. Se decide por el tamaño del HTML (gratis
+# de medir) y solo con 4+ CPUs; con 2 el pool no llega a recuperar el coste.
+PARALLEL_MIN_HTML_BYTES = 8_000_000
+PARALLEL_MIN_CPUS = 4
+
+# -------------------------
+# Utilidades de recorrido (Lexbor)
+# -------------------------
+def element_children(node) -> List:
+    """Hijos inmediatos que son etiquetas (iter() de Lexbor incluye comentarios)."""
+    return [c for c in node.iter() if c.is_element_node]
+
+
+def _attr_value(v) -> str:
+    # Lexbor devuelve None para atributos sin valor (p. ej. `disabled`)
+    return "" if v is None else v
+
+
 # -------------------------
 # Extracción simple de atributos (sin heurísticas externas)
 # -------------------------
@@ -21,38 +46,43 @@ def collect_attrs(unit) -> Dict[str, str]:
     """
     attrs = {}
 
-    # root attrs
-    for k, v in unit.attrs.items():
-        attrs[f"self::{k}"] = ' '.join(v) if isinstance(v, list) else str(v)
-
-    # texto interno
-    text = unit.get_text(" ", strip=True)
-    if text:
-        attrs["self::text"] = text
-
-    # descendientes
-    for child in unit.find_all(recursive=True):
-        if not getattr(child, "name", None):
+    # DFS con pila explícita: cada entrada lleva su path relativo ya construido
+    # ("" = la propia unidad), así que no se recorren ancestros por descendiente.
+    # Los textos se arman de abajo arriba al salir de cada nodo, reutilizando
+    # los de sus hijos en vez de volver a extraer el subárbol completo.
+    # El contenido de <template> no aparece: Lexbor lo guarda fuera del árbol.
+    texts: List[List[str]] = [[]]
+    stack = [(unit, "", False)]
+    while stack:
+        node, rel_path, leaving = stack.pop()
+
+        # texto del nodo (unidad o descendiente) al cerrar su subárbol
+        if leaving:
+            txt = " ".join(texts.pop())
+            if txt:
+                if node.tag not in NON_VISIBLE_TEXT_TAGS:
+                    texts[-1].append(txt)
+                attrs[f"{rel_path or 'self'}::text"] = txt
             continue
 
-        # construir path relativo
-        path_parts = []
-        node = child
-        while node is not None and node != unit:
-            if getattr(node, "name", None):
-                path_parts.append(node.name)
-            node = node.parent
+        if node.is_text_node:
+            fragment = node.text_content.strip()
+            if fragment:
+                texts[-1].append(fragment)
+            continue
 
-        rel_path = "/".join(reversed(path_parts)) if path_parts else child.name
+        if not node.is_element_node:
+            continue
 
-        # atributos del descendiente
-        for k, v in child.attrs.items():
-            attrs[f"{rel_path}::{k}"] = ' '.join(v) if isinstance(v, list) else str(v)
+        # atributos de la unidad (self::) o del descendiente
+        for k, v in node.attributes.items():
+            attrs[f"{rel_path or 'self'}::{k}"] = _attr_value(v)
 
-        # texto del descendiente
-        txt = child.get_text(" ", strip=True)
-        if txt:
-            attrs[f"{rel_path}::text"] = txt
+        texts.append([])
+        stack.append((node, rel_path, True))
+        prefix = f"{rel_path}/" if rel_path else ""
+        for child in reversed(list(node.iter(include_text=True))):
+            stack.append((child, prefix + child.tag if child.is_element_node else rel_path, False))
 
     return attrs
 
@@ -67,74 +97,78 @@ def analyze_container(container, min_units: int = 2, threshold_shared: float = 0
       - semantic_variable_attrs
       - noise_attrs
     """
-    units = [c for c in container.find_all(recursive=False) if getattr(c, "name", None)]
+    units = element_children(container)
     if len(units) < min_units:
         return None
 
     attrs_per_unit = [collect_attrs(u) for u in units]
-    all_attr_keys = set().union(*[set(d.keys()) for d in attrs_per_unit])
 
-    n = len(units)
-    stats = {}
+    # Una sola pasada sobre las unidades agrupa los valores por atributo (en
+    # orden de aparición); de ahí salen conteos, longitudes y muestras
+    values_by_attr: Dict[str, List[str]] = defaultdict(list)
+    for d in attrs_per_unit:
+        for attr, value in d.items():
+            values_by_attr[attr].append(value)
 
-    for attr in all_attr_keys:
-        values = [d.get(attr) for d in attrs_per_unit]
-        present = sum(1 for v in values if v is not None)
-        existing_values = [v for v in values if v is not None]
-
-        if existing_values:
-            lengths = [len(v) for v in existing_values]
-            length_var = statistics.pvariance(lengths) if len(lengths) > 1 else 0.0
-            uniq = len(set(existing_values))
-            avg_length = statistics.mean(lengths)
-        else:
-            length_var = 0.0
-            uniq = 0
-            avg_length = 0.0
+    n = len(units)
+    attr_keys = np.array(list(values_by_attr), dtype=object)
+    present_counts = []
+    unique_counts = []
+    avg_lengths = []
+    length_vars = []
+    for values in values_by_attr.values():
+        lengths = [len(v) for v in values]
+        k = len(lengths)
+        mean = sum(lengths) / k
+        present_counts.append(k)
+        unique_counts.append(len(set(values)))
+        avg_lengths.append(mean)
+        length_vars.append(sum((x - mean) ** 2 for x in lengths) / k)
+
+    present = np.array(present_counts, dtype=float)
+    uniq = np.array(unique_counts, dtype=float)
+    avg_length = np.array(avg_lengths, dtype=float)
+    length_var = np.array(length_vars, dtype=float)
+
+    p = present / n
+    u = np.divide(uniq, present, out=np.zeros_like(uniq), where=present > 0)
+    complexity = avg_length + length_var
+
+    # Clasificación puramente estadística con máscaras booleanas sobre todos
+    # los atributos a la vez (sin cadena if/elif por clave)
+    fully_present = p >= threshold_shared
+    partly_present = (p >= threshold_variable_presence) & ~fully_present
+    is_shared = fully_present & (u < 0.15) & (complexity < 8)
+    is_variable = (fully_present & ~is_shared) | (partly_present & ((u > 0.15) | (complexity > 10)))
+    is_noise = ~(is_shared | is_variable)
+
+    shared = sorted(attr_keys[is_shared].tolist())
+    variable = sorted(attr_keys[is_variable].tolist())
+    noise = sorted(attr_keys[is_noise].tolist())
 
+    stats = {}
+    for (attr, values), a_present, a_uniq, a_p, a_u, a_avg, a_var in zip(
+        values_by_attr.items(),
+        present_counts,
+        unique_counts,
+        p.tolist(),
+        u.tolist(),
+        avg_lengths,
+        length_vars,
+    ):
         stats[attr] = {
-            "present": present,
-            "present_ratio": present / n,
-            "unique_values": uniq,
-            "unique_ratio": (uniq / present) if present else 0.0,
-            "avg_length": avg_length,
-            "length_var": length_var,
-            "sample_values": existing_values[:6],
+            "present": a_present,
+            "present_ratio": a_p,
+            "unique_values": a_uniq,
+            "unique_ratio": a_u,
+            "avg_length": a_avg,
+            "length_var": a_var,
+            "sample_values": values[:6],
         }
 
-    shared = []
-    variable = []
-    noise = []
-
-    # Clasificación puramente estadística
-    for attr, s in stats.items():
-        p = s["present_ratio"]
-        u = s["unique_ratio"]
-        complexity = s["avg_length"] + s["length_var"]
-
-        if p >= threshold_shared:
-            if u < 0.15 and complexity < 8:
-                shared.append(attr)
-            else:
-                variable.append(attr)
-            continue
-
-        if p >= threshold_variable_presence:
-            if u > 0.15 or complexity > 10:
-                variable.append(attr)
-            else:
-                noise.append(attr)
-            continue
-
-        noise.append(attr)
-
-    shared.sort()
-    variable.sort()
-    noise.sort()
-
     return {
-        "container_tag": container.name,
-        "unit_root_tag": units[0].name if units else None,
+        "container_tag": container.tag,
+        "unit_root_tag": units[0].tag if units else None,
         "unit_count": n,
         "shared_attrs": shared,
         "semantic_variable_attrs": variable,
@@ -147,14 +181,22 @@ def analyze_container(container, min_units: int = 2, threshold_shared: float = 0
 # Verificación de que un elemento es contenedor válido
 # -------------------------
 def es_contenedor_valido(elem, min_units: int = 2, max_child_tag_variation: int = 3) -> bool:
-    hijos = [c for c in elem.find_all(recursive=False) if getattr(c, "name", None)]
+    # Una sola pasada sobre los hijos directos, sin listas intermedias
+    n_hijos = 0
+    nombres_hijos = set()
+    for c in elem.iter():
+        if not c.is_element_node:
+            continue
+        n_hijos += 1
+        # con 6+ hijos la variación de etiquetas ya no descarta el contenedor
+        if n_hijos >= 6 and n_hijos >= min_units:
+            return True
+        nombres_hijos.add(c.tag)
 
-    if len(hijos) < min_units:
+    if n_hijos < min_units:
         return False
 
-    nombres_hijos = [c.name for c in hijos]
-
-    if len(set(nombres_hijos)) > max_child_tag_variation and len(hijos) < 6:
+    if len(nombres_hijos) > max_child_tag_variation and n_hijos < 6:
         return False
 
     return True
@@ -163,19 +205,24 @@ def es_contenedor_valido(elem, min_units: int = 2, max_child_tag_variation: int
 # -------------------------
 # Detección de candidatos contenedores
 # -------------------------
-def candidate_containers(soup, container_tags: List[str] = None, min_units: int = 2):
+def candidate_containers(tree, container_tags: List[str] = None, min_units: int = 2):
     if container_tags is None:
         container_tags = ["div", "span", "section", "article", "ul", "ol"]
 
-    raw = [c for c in soup.find_all(container_tags)]
+    # El selector CSS filtra por etiqueta dentro de Lexbor (equivalente a un
+    # SoupStrainer, pero sin perder los hijos que analyze_container necesita)
+    raw = tree.css(", ".join(container_tags))
     valids = [c for c in raw if es_contenedor_valido(c, min_units=min_units)]
+    # set de mem_id: en selectolax `==` compara el HTML serializado, no la
+    # identidad del nodo; además la pertenencia es O(1) en vez de lineal
+    valid_ids = {c.mem_id for c in valids}
 
     final = []
     for c in valids:
         parent = c.parent
         is_nested = False
-        while parent is not None and getattr(parent, "name", None):
-            if parent in valids:
+        while parent is not None and parent.is_element_node:
+            if parent.mem_id in valid_ids:
                 is_nested = True
                 break
             parent = parent.parent
@@ -186,18 +233,48 @@ def candidate_containers(soup, container_tags: List[str] = None, min_units: int
     return final
 
 
+# -------------------------
+# Análisis en paralelo (los nodos Lexbor no se serializan)
+# -------------------------
+def _analyze_fragment(args):
+    """Worker: re-parsea el HTML de un contenedor y lo analiza."""
+    fragment, min_units = args
+    tree = LexborHTMLParser(fragment)
+    roots = element_children(tree.body) if tree.body is not None else []
+    if not roots:
+        return None
+    return analyze_container(roots[0], min_units=min_units)
+
+
+def _analyze_containers_parallel(containers, min_units: int = 2):
+    tasks = [(c.html, min_units) for c in containers]
+    processes = min(mp.cpu_count(), len(tasks))
+    chunksize = max(1, len(tasks) // (processes * 4))
+
+    # spawn: no hereda por fork la memoria del proceso de Streamlit
+    with mp.get_context("spawn").Pool(processes) as pool:
+        return [r for r in pool.imap(_analyze_fragment, tasks, chunksize=chunksize) if r]
+
+
 # -------------------------
 # Análisis global del HTML
 # -------------------------
 def analyze_html_all(html: str, min_units: int = 2):
-    soup = BeautifulSoup(html, "html.parser")
-    containers = candidate_containers(soup, min_units=min_units)
-
-    results = []
-    for c in containers:
-        r = analyze_container(c, min_units=min_units)
-        if r:
-            results.append(r)
+    tree = LexborHTMLParser(html)
+    containers = candidate_containers(tree, min_units=min_units)
+
+    if (
+        len(html) >= PARALLEL_MIN_HTML_BYTES
+        and len(containers) > 1
+        and mp.cpu_count() >= PARALLEL_MIN_CPUS
+    ):
+        results = _analyze_containers_parallel(containers, min_units=min_units)
+    else:
+        results = []
+        for c in containers:
+            r = analyze_container(c, min_units=min_units)
+            if r:
+                results.append(r)
 
     results.sort(
         key=lambda x: (